@@ -17,6 +17,28 @@ except ImportError as ex:
     log.error('Unable to import "playhouse.apsw_ext": %s', ex, exc_info=True)
     APSWDatabase = None
 
+# Connection pragmas (connection-local, valid on a read-only connection - the
+# journal mode itself is owned by the Plex server and can't be changed here)
+DB_PRAGMAS = [
+    ('mmap_size',   268435456),  # Map up to 256 MB of the database
+    ('cache_size',  -65536),     # 64 MB page cache
+    ('temp_store',  'MEMORY'),
+    ('query_only',  1)
+]
+
+if APSWDatabase:
+    class PlexDatabase(APSWDatabase):
+        def initialize_connection(self, conn):
+            cursor = conn.cursor()
+
+            for key, value in DB_PRAGMAS:
+                try:
+                    cursor.execute('PRAGMA %s=%s;' % (key, value))
+                except Exception as ex:
+                    log.debug('Unable to set pragma %r: %s', key, ex, exc_info=True)
+else:
+    PlexDatabase = None
+
 # Locate "com.plexapp.plugins.library.db"
 if os.environ.get('LIBRARY_DB'):
     db_path = os.path.abspath(os.environ['LIBRARY_DB'])
@@ -28,6 +50,6 @@ else:
 if db_path and apsw and APSWDatabase:
     log.debug('Connecting to %r', db_path)
 
-    db = APSWDatabase(db_path, flags=apsw.SQLITE_OPEN_READONLY, journal_mode='WAL')
+    db = PlexDatabase(db_path, flags=apsw.SQLITE_OPEN_READONLY, journal_mode='WAL')
 else:
     db = None
@@ -3,6 +3,7 @@ from plex_database.models import *
 from plex_metadata.guid import Guid
 
 from datetime import datetime
+from itertools import chain, izip
 from peewee import JOIN_LEFT_OUTER, DateTimeField, FieldProxy
 from stash.algorithms.core.prime_context import PrimeContext
 import logging
@@ -22,6 +23,15 @@ except Exception:
 
     log.warn('Unable to retrieve system timezone, datetime objects will be returned in local time', exc_info=True)
 
+# Cache UTC offsets when converting datetime columns (one timezone lookup per
+# distinct day, instead of one `pytz` localization per value). Disable to
+# resolve the timezone for every value.
+CACHE_UTC_OFFSETS = True
+
+# Maximum number of episodes retrieved per page in `mapped_episodes` (rows
+# for a multi-part episode are always kept in the same page)
+EPISODE_BATCH = 5000
+
 MODEL_KEYS = {
     MediaItem:              'media',
     MediaPart:              'part',
@@ -29,6 +39,22 @@ MODEL_KEYS = {
     MetadataItemSettings:   'settings'
 }
 
+# Models whose fields are stored at the top level of parsed items
+TOP_LEVEL_MODELS = frozenset([
+    MetadataItem,
+    Episode
+])
+
+
+class CountedIterator(object):
+    # Iterator wrapper exposing the total number of items as `count`
+    def __init__(self, iterator, count):
+        self.iterator = iterator
+        self.count = count
+
+    def __iter__(self):
+        return self.iterator
+
 
 class LibraryBase(object):
     def __init__(self, library=None):
@@ -67,26 +93,133 @@ class LibraryBase(object):
         return result
 
     @staticmethod
-    def _tuple_iterator(query):
-        result = query.tuples().execute()
+    def _normalize(sections, account=None):
+        # Retrieve `id` from `Account`
+        if account and type(account) is Account:
+            account = account.id
+
+        # Map `Section` list to ids (tuple, so peewee can re-use the
+        # rendered parameter list across queries)
+        section_ids = tuple(id for (id, ) in sections)
+
+        return section_ids, account
+
+    # Rendered SQL cache - sync runs re-issue structurally identical queries,
+    # so the rendered (sql, params) pair is re-used when the query shape
+    # (method, fields, sections, account) is unchanged
+    _sql_cache = {}
+
+    @classmethod
+    def _execute_cached(cls, key):
+        # Execute the query rendered under `key`, returning `None` when the
+        # query hasn't been rendered yet (or `key` is `None`)
+        if key is None:
+            return None
+
+        cached = cls._sql_cache.get(key)
+
+        if cached is None:
+            return None
+
+        database, sql, params, require_commit = cached
+
+        return database.execute_sql(sql, params, require_commit)
+
+    @classmethod
+    def _execute(cls, query, key=None):
+        # Execute `query`, caching the rendered SQL under `key` (if provided)
+        if key is None:
+            return query._execute()
+
+        # Avoid unbounded growth (keys contain caller-provided field sets)
+        if len(cls._sql_cache) >= 64:
+            cls._sql_cache.clear()
+
+        sql, params = query.sql()
+
+        cls._sql_cache[key] = (query.database, sql, params, query.require_commit)
+
+        return query.database.execute_sql(sql, params, query.require_commit)
+
+    # Result of the window-function probe (requires SQLite >= 3.25)
+    _window_supported = None
+
+    @classmethod
+    def _supports_window_count(cls):
+        if LibraryBase._window_supported is None:
+            try:
+                MetadataItem._meta.database.execute_sql('SELECT COUNT(*) OVER ()', (), False)
+
+                LibraryBase._window_supported = True
+            except Exception:
+                LibraryBase._window_supported = False
+
+                log.debug('Window functions not supported, counting with a separate query', exc_info=True)
+
+        return LibraryBase._window_supported
+
+    @classmethod
+    def _batch_iterator(cls, cursor, size=1000):
+        fetchone = cursor.fetchone
 
         while True:
+            rows = []
+            exhausted = False
+
+            # Retrieve a batch of rows (one exception handler per batch,
+            # instead of one per row)
             try:
-                row = result.iterate()
+                for _ in xrange(size):
+                    row = fetchone()
+
+                    if row is None:
+                        exhausted = True
+                        break
+
+                    rows.append(row)
             except UnicodeDecodeError as ex:
                 log.warn('Unable to retrieve row: %s', ex, exc_info=True, extra={
                     'event': {
                         'module': __name__,
-                        'name': '_tuple_iterator.iterate.unicode_decode_error',
+                        'name': '_batch_iterator.fetchone.unicode_decode_error',
                         'key': '%s:%s' % (ex.encoding, ex.reason)
                     }
                 })
-                continue
 
-            yield row
+                # Continue with the rows retrieved so far (only the failing
+                # row is dropped)
+
+            for row in rows:
+                yield row
+
+            if exhausted:
+                break
+
+    # Resolved model sets, keyed on the identities of the `fields` provided
+    # (model fields are module-level singletons, so identity is stable)
+    _models_cache = {}
+
+    @classmethod
+    def _models(cls, fields, account=None):
+        key = (
+            tuple(id(field) for field in fields),
+            account is None
+        )
+
+        models = cls._models_cache.get(key)
+
+        if models is None:
+            # Avoid unbounded growth (transient fields, e.g. tag subquery
+            # columns, produce a new key per call)
+            if len(cls._models_cache) >= 64:
+                cls._models_cache.clear()
+
+            models = cls._models_cache[key] = tuple(cls._resolve_models(fields, account))
+
+        return models
 
     @staticmethod
-    def _models(fields, account=None):
+    def _resolve_models(fields, account=None):
         models = {}
 
         for field in fields:
@@ -145,64 +278,126 @@ class LibraryBase(object):
         return query
 
     @classmethod
-    def _parse(cls, fields, row, offset=0):
-        item = {}
+    def _compile_parsers(cls, fields, offset=0):
+        compiled = []
+        datetime_parser = None
 
-        for x in xrange(offset, len(fields)):
-            field = fields[x]
-            value = row[x]
+        for field in fields[offset:]:
+            # Resolve proxied field
+            resolved = field
 
-            try:
-                # Parse field
-                value = cls._parse_field(field, value)
-            except Exception as ex:
-                log.error('Unable to parse value %r as field %r', value, field)
-                raise ex
-
-            # Update `item` with field
-            if field.model_class in [MetadataItem, Episode]:
-                item[field.name] = value
+            if type(resolved) is FieldProxy:
+                resolved = resolved.field_instance
+
+            # Resolve value parser
+            if type(resolved) is DateTimeField:
+                if datetime_parser is None:
+                    datetime_parser = cls._build_datetime_parser()
+
+                parser = datetime_parser
+            else:
+                parser = None
+
+            # Resolve item destination
+            if field.model_class in TOP_LEVEL_MODELS:
+                key = None
             elif field.model_class in MODEL_KEYS:
                 key = MODEL_KEYS[field.model_class]
+            else:
+                raise ValueError('Unable to parse field %r, unknown model %r' % (field, field.model_class))
 
-                if key not in item:
-                    item[key] = {}
+            compiled.append((parser, key, field.name))
 
-                item[key][field.name] = value
+        return compiled
+
+    @classmethod
+    def _parse(cls, fields, row, offset=0, parsers=None):
+        if parsers is None:
+            parsers = cls._compile_parsers(fields, offset)
+
+        item = {}
+
+        for (parser, key, name), value in izip(parsers, row[offset:]):
+            if parser is not None:
+                try:
+                    # Parse value
+                    value = parser(value)
+                except Exception as ex:
+                    log.error('Unable to parse value %r as field %r', value, name)
+                    raise ex
+
+            # Update `item` with value
+            if key is None:
+                item[name] = value
             else:
-                raise ValueError('Unable to parse field %r, unknown model %r' % (field, field.model_class))
+                bucket = item.get(key)
 
-        return tuple(list(row[:offset]) + [item])
+                if bucket is None:
+                    bucket = item[key] = {}
 
-    @staticmethod
-    def _parse_field(field, value):
-        if type(field) is FieldProxy:
-            field = field.field_instance
+                bucket[name] = value
+
+        # Rows are already tuples (DB-API cursors), concatenate directly
+        return row[:offset] + (item,)
+
+    @classmethod
+    def _build_datetime_parser(cls):
+        if not TZ_LOCAL or not pytz or not CACHE_UTC_OFFSETS:
+            return cls._parse_datetime
+
+        utc = pytz.utc
+        offsets = {}
 
-        if type(field) is DateTimeField:
+        def parse_datetime(value):
             if not value:
-               return None
+                return None
 
             if isinstance(value, int):
-               value = datetime.fromtimestamp(value)
-               return TZ_LOCAL.localize(value).astimezone(pytz.utc)
+                # Timestamps are stored in UTC
+                return datetime.utcfromtimestamp(value).replace(tzinfo=utc)
 
             if not isinstance(value, datetime):
-               log.debug('Invalid value provided for DateTimeField: %r (expected datetime instance)', value)
-               return None
+                log.debug('Invalid value provided for DateTimeField: %r (expected datetime instance)', value)
+                return None
 
             if value.tzinfo:
                 # `tzinfo` provided, ignore conversion
                 return value
 
-            if not TZ_LOCAL or not pytz:
-                # Missing "tzlocal" or "pytz" module
-                return value
+            # Convert datetime to UTC, using the offset cached for this day
+            key = (value.year, value.month, value.day)
+            offset = offsets.get(key)
+
+            if offset is None:
+                offset = offsets[key] = TZ_LOCAL.utcoffset(value)
+
+            return (value - offset).replace(tzinfo=utc)
 
-            # Convert datetime to UTC
+        return parse_datetime
+
+    @staticmethod
+    def _parse_datetime(value):
+        if not value:
+            return None
+
+        if isinstance(value, int):
+            value = datetime.fromtimestamp(value)
             return TZ_LOCAL.localize(value).astimezone(pytz.utc)
 
-        return value
+        if not isinstance(value, datetime):
+            log.debug('Invalid value provided for DateTimeField: %r (expected datetime instance)', value)
+            return None
+
+        if value.tzinfo:
+            # `tzinfo` provided, ignore conversion
+            return value
+
+        if not TZ_LOCAL or not pytz:
+            # Missing "tzlocal" or "pytz" module
+            return value
+
+        # Convert datetime to UTC
+        return TZ_LOCAL.localize(value).astimezone(pytz.utc)
 
 
 class MovieLibrary(LibraryBase):
@@ -216,19 +411,34 @@ class MovieLibrary(LibraryBase):
             MetadataItem.guid
         ] + fields
 
-        # Build query
-        query = self.query(
-            sections,
-            fields=fields,
-            account=account,
-            where=where
-        )
+        # Re-use rendered SQL for the plain query shape (`where` conditions
+        # are caller-specific, so filtered queries aren't cached)
+        if where is None:
+            key = ('movies', tuple(id(field) for field in fields)) + self._normalize(sections, account)
+        else:
+            key = None
 
-        # Parse rows
-        return [
-            self._parse(fields, row, offset=2)
-            for row in self._tuple_iterator(query)
-        ]
+        cursor = self._execute_cached(key)
+
+        if cursor is None:
+            # Build query
+            query = self.query(
+                sections,
+                fields=fields,
+                account=account,
+                where=where
+            )
+
+            cursor = self._execute(query, key)
+
+        # Parse rows (lazily, memory stays proportional to one row - wrap in
+        # `list()` if the result needs to be retained or iterated multiple times)
+        parsers = self._compile_parsers(fields, offset=2)
+
+        return (
+            self._parse(fields, row, offset=2, parsers=parsers)
+            for row in self._batch_iterator(cursor)
+        )
 
     def count(self, sections, account=None):
         # Build query
@@ -243,12 +453,8 @@ class MovieLibrary(LibraryBase):
         return query.count()
 
     def query(self, sections, fields=None, account=None, where=None):
-        # Retrieve `id` from `Account`
-        if account and type(account) is Account:
-            account = account.id
-
-        # Map `Section` list to ids
-        section_ids = [id for (id, ) in sections]
+        # Normalize `sections` / `account` arguments
+        section_ids, account = self._normalize(sections, account)
 
         # Build `select()` query
         if fields is None:
@@ -263,46 +469,24 @@ class MovieLibrary(LibraryBase):
             MetadataItem.metadata_type == MetadataItemType.Movie
         ]
 
-        # Build query
+        # Build query (ordered by primary key, for sequential page access)
         return self._join(
             MetadataItem.select(*fields),
             self._models(fields, account),
             account
         ).where(
             *where
+        ).order_by(
+            MetadataItem.id.asc()
         )
 
-    def mapped(self, sections, fields=None, account=None, where=None, parse_guid=False):
-        # Retrieve `id` from `Account`
-        if account and type(account) is Account:
-            account = account.id
-
-        # Map `Section` list to ids
-        section_ids = [id for (id, ) in sections]
-
-        # Build `select()` query
+    def mapped(self, sections, fields=None, account=None, where=None, parse_guid=False, with_count=False):
+        # Build `select()` fields (the id/guid/tag prefix is appended at
+        # query-build time, and consumed positionally by the iterator)
         if fields is None:
             fields = []
 
-        # Build subquery
-        subq = (Taggings
-                        .select(
-                            Tags.tag_type,
-                            Tags.tag,
-                            Taggings.metadata_item
-                        )
-                        .join(Tags, on=(Tags.id == Taggings.tag).alias('taggings'))
-                        .where(Tags.tag_type == 314)
-                        .order_by(Tags.id.asc())
-                        .switch(Taggings)
-                        .alias('subq')
-        )
-
         fields = [
-            MetadataItem.id,
-            MetadataItem.guid,
-            subq.c.tag,
-
             MediaPart.duration,
             MediaPart.file,
 
@@ -312,133 +496,226 @@ class MovieLibrary(LibraryBase):
             MetadataItemSettings.last_viewed_at
         ] + fields
 
-        # Build `where()` query
-        if where is None:
-            where = []
-
-        where += [
-            MetadataItem.library_section << section_ids,
-            MetadataItem.metadata_type == MetadataItemType.Movie
-        ]
-
-        # Build query
-        query = (MetadataItem.select(*fields)
-                             .join(subq, JOIN_LEFT_OUTER, on=(subq.c.metadata_item_id == MetadataItem.id).alias('tags'))
-                             .switch(MetadataItem)
-                             .join(MediaItem, on=(MediaItem.metadata_item == MetadataItem.id).alias('media'))
-                             .join(MediaPart, on=(MediaPart.media_item == MediaItem.id).alias('part'))
-                             .switch(MetadataItem)
-        )
+        # Retrieve the total with the same scan, when requested (falls back
+        # to a separate count query on older SQLite builds)
+        include_total = with_count and self._supports_window_count()
 
-        # Join settings
-        query = self._join_settings(query, account, MetadataItem)
+        # Re-use rendered SQL for the plain query shape (`where` conditions
+        # are caller-specific, so filtered queries aren't cached)
+        if where is None:
+            key = ('movies.mapped', include_total, tuple(id(field) for field in fields)) + self._normalize(sections, account)
+        else:
+            key = None
+
+        cursor = self._execute_cached(key)
+
+        if cursor is None:
+            # Normalize `sections` / `account` arguments
+            section_ids, account = self._normalize(sections, account)
+
+            # Build subquery (one tag per item - SQLite resolves the bare `tag`
+            # column from the `MIN(id)` row, matching the previous first-wins order)
+            subq = (Taggings
+                            .select(
+                                Tags.tag,
+                                peewee.fn.MIN(Tags.id),
+                                Taggings.metadata_item
+                            )
+                            .join(Tags, on=(Tags.id == Taggings.tag).alias('taggings'))
+                            .where(Tags.tag_type == 314)
+                            .group_by(Taggings.metadata_item)
+                            .switch(Taggings)
+                            .alias('subq')
+            )
+
+            select_fields = [
+                MetadataItem.id,
+                MetadataItem.guid,
+                subq.c.tag
+            ] + fields
+
+            # Build `where()` query
+            if where is None:
+                where = []
+
+            where += [
+                MetadataItem.library_section << section_ids,
+                MetadataItem.metadata_type == MetadataItemType.Movie
+            ]
+
+            # Prepend the window total column (parsed models are resolved
+            # from `select_fields`, which excludes it)
+            if include_total:
+                select_columns = [peewee.SQL('COUNT(*) OVER ()')] + select_fields
+            else:
+                select_columns = select_fields
+
+            # Build query
+            query = (MetadataItem.select(*select_columns)
+                                 .join(subq, JOIN_LEFT_OUTER, on=(subq.c.metadata_item_id == MetadataItem.id).alias('tags'))
+                                 .switch(MetadataItem)
+                                 .join(MediaItem, on=(MediaItem.metadata_item == MetadataItem.id).alias('media'))
+                                 .join(MediaPart, on=(MediaPart.media_item == MediaItem.id).alias('part'))
+                                 .switch(MetadataItem)
+            )
+
+            # Join settings
+            query = self._join_settings(query, account, MetadataItem)
+
+            # Join extra models
+            models = self._models(select_fields, account)
+
+            query = self._join(query, models, account, [
+                MetadataItemSettings,
+                MediaItem,
+                MediaPart,
+                Taggings,
+                Tags
+            ])
+
+            # Apply `WHERE` filter (ordered by primary key, for sequential page access)
+            query = query.where(
+                *where
+            ).order_by(
+                MetadataItem.id.asc()
+            )
+
+            cursor = self._execute(query, key)
 
-        # Join extra models
-        models = self._models(fields, account)
+        # Iterate over items, parse guid (if enabled)
+        parsers = self._compile_parsers(fields)
+        guid_parse = Guid.parse
 
-        query = self._join(query, models, account, [
-            MetadataItemSettings,
-            MediaItem,
-            MediaPart,
-            Taggings,
-            Tags
-        ])
+        total = [None]
 
-        # Apply `WHERE` filter
-        query = query.where(
-            *where
-        )
+        def movies_iterator():
+            last_id = None
+            last_guid = None
 
-        # Iterate over items, parse guid (if enabled)
-        guids = {}
+            for row in self._batch_iterator(cursor):
+                if include_total:
+                    total[0] = row[0]
+                    row = row[1:]
 
-        def movies_iterator():
-            for row in self._tuple_iterator(query):
-                id, guid, tag, movie = self._parse(fields, row, offset=3)
+                id, guid, tag, movie = self._parse(fields, row, offset=3, parsers=parsers)
 
-                # Parse `guid` (if enabled, and not already parsed)
+                # Parse `guid` (if enabled) - tags are already deduped in SQL,
+                # only multi-part movies repeat (those rows arrive adjacently)
                 if parse_guid:
-                    if id not in guids:
-                        if tag:
-                            guids[id] = Guid.parse(tag, strict=True)
-                        else:
-                            guids[id] = Guid.parse(guid, strict=True)
-                    guid = guids[id]
+                    if id == last_id:
+                        guid = last_guid
+                    else:
+                        guid = guid_parse(tag or guid, strict=True)
+
+                        last_id = id
+                        last_guid = guid
 
                 # Return item
                 yield id, guid, movie
 
-        return movies_iterator()
+        movies = movies_iterator()
 
+        if not with_count:
+            return movies
 
-class ShowLibrary(LibraryBase):
-    def __call__(self, sections, fields=None, account=None, where=None):
-        # Set default `select()` fields
-        if fields is None:
-            fields = []
-        
-        subq = (Taggings
-                .select(
-                    Tags.tag_type,
-                    Tags.tag,
-                    Taggings.metadata_item
-                )
-                .join(Tags, on=(Tags.id == Taggings.tag).alias('taggings'))
-                .where(Tags.tag_type == 314)
-                .order_by(Tags.id.asc())
-                .switch(Taggings)
-                .alias('subq')
-        )
+        if include_total:
+            # Fetch the first item, so the window total is populated
+            try:
+                first = next(movies)
+            except StopIteration:
+                return CountedIterator(iter([]), 0)
 
-        fields = [
-            MetadataItem.id,
-            MetadataItem.guid,
-            subq.c.tag
-        ] + fields
+            return CountedIterator(chain([first], movies), total[0])
 
-        query = (MetadataItem.select(*fields)
-                        .join(subq, JOIN_LEFT_OUTER, on=(subq.c.metadata_item_id == MetadataItem.id).alias('tags'))
-                        .switch(MetadataItem)
-        )
+        # Window functions unavailable, count with a separate query
+        return CountedIterator(movies, self.count(sections, account=account))
 
-        if account and type(account) is Account:
-            account = account.id
 
-        # Map `Section` list to ids
-        section_ids = [id for (id, ) in sections]
+class ShowLibrary(LibraryBase):
+    def __call__(self, sections, fields=None, account=None, where=None):
+        # Set default `select()` fields (the id/guid/tag prefix is appended
+        # at query-build time, and consumed positionally)
+        if fields is None:
+            fields = []
 
-        # Build `where()` query
+        # Re-use rendered SQL for the plain query shape (`where` conditions
+        # are caller-specific, so filtered queries aren't cached)
         if where is None:
-            where = []
-
-        where += [
-            MetadataItem.library_section << section_ids,
-            MetadataItem.metadata_type == MetadataItemType.Show
-        ]
-
-        # Join settings
-        query = self._join_settings(query, account, MetadataItem)
-
-        # Join extra models
-        models = self._models(fields, account)
-
-        query = self._join(query, models, account, [
-            MetadataItemSettings,
-            Taggings,
-            Tags
-        ])
-
-        # Apply `WHERE` filter
-        query = query.where(
-            *where
+            key = ('shows', tuple(id(field) for field in fields)) + self._normalize(sections, account)
+        else:
+            key = None
+
+        cursor = self._execute_cached(key)
+
+        if cursor is None:
+            # Build subquery (one tag per item - SQLite resolves the bare `tag`
+            # column from the `MIN(id)` row, matching the previous first-wins order)
+            subq = (Taggings
+                    .select(
+                        Tags.tag,
+                        peewee.fn.MIN(Tags.id),
+                        Taggings.metadata_item
+                    )
+                    .join(Tags, on=(Tags.id == Taggings.tag).alias('taggings'))
+                    .where(Tags.tag_type == 314)
+                    .group_by(Taggings.metadata_item)
+                    .switch(Taggings)
+                    .alias('subq')
+            )
+
+            select_fields = [
+                MetadataItem.id,
+                MetadataItem.guid,
+                subq.c.tag
+            ] + fields
+
+            query = (MetadataItem.select(*select_fields)
+                            .join(subq, JOIN_LEFT_OUTER, on=(subq.c.metadata_item_id == MetadataItem.id).alias('tags'))
+                            .switch(MetadataItem)
+            )
+
+            # Normalize `sections` / `account` arguments
+            section_ids, account = self._normalize(sections, account)
+
+            # Build `where()` query
+            if where is None:
+                where = []
+
+            where += [
+                MetadataItem.library_section << section_ids,
+                MetadataItem.metadata_type == MetadataItemType.Show
+            ]
+
+            # Join settings
+            query = self._join_settings(query, account, MetadataItem)
+
+            # Join extra models
+            models = self._models(select_fields, account)
+
+            query = self._join(query, models, account, [
+                MetadataItemSettings,
+                Taggings,
+                Tags
+            ])
+
+            # Apply `WHERE` filter (ordered by primary key, for sequential page access)
+            query = query.where(
+                *where
+            ).order_by(
+                MetadataItem.id.asc()
+            )
+
+            cursor = self._execute(query, key)
+
+        # Parse rows (lazily, memory stays proportional to one row - wrap in
+        # `list()` if the result needs to be retained or iterated multiple times)
+        parsers = self._compile_parsers(fields)
+
+        return (
+            self._parse(fields, row, offset=3, parsers=parsers)
+            for row in self._batch_iterator(cursor)
         )
 
-        # Parse rows
-        return [
-            self._parse(fields, row, offset=3)
-            for row in self._tuple_iterator(query)
-        ]
-
     def count(self, sections, account=None):
         # Build query
         query = self.query(
@@ -452,12 +729,8 @@ class ShowLibrary(LibraryBase):
         return query.count()
 
     def query(self, sections, fields=None, account=None, where=None):
-        # Retrieve `id` from `Account`
-        if account and type(account) is Account:
-            account = account.id
-
-        # Map `Section` list to ids
-        section_ids = [id for (id, ) in sections]
+        # Normalize `sections` / `account` arguments
+        section_ids, account = self._normalize(sections, account)
 
         # Build `select()` query
         if fields is None:
@@ -472,25 +745,20 @@ class ShowLibrary(LibraryBase):
             MetadataItem.metadata_type == MetadataItemType.Show
         ]
 
-        # Build query
+        # Build query (ordered by primary key, for sequential page access)
         return self._join(
             MetadataItem.select(*fields),
             self._models(fields, account),
             account
         ).where(
             *where
+        ).order_by(
+            MetadataItem.id.asc()
         )
 
 
 class SeasonLibrary(LibraryBase):
     def __call__(self, sections, fields=None, account=None, where=None):
-        # Retrieve `id` from `Account`
-        if account and type(account) is Account:
-            account = account.id
-
-        # Map `Section` list to ids
-        section_ids = [id for (id, ) in sections]
-
         # Build `select()` query
         if fields is None:
             fields = []
@@ -500,30 +768,50 @@ class SeasonLibrary(LibraryBase):
             MetadataItem.index
         ] + fields
 
-        # Build `where()` query
+        # Re-use rendered SQL for the plain query shape (`where` conditions
+        # are caller-specific, so filtered queries aren't cached)
         if where is None:
-            where = []
-
-        where += [
-            MetadataItem.metadata_type == MetadataItemType.Season,
-            MetadataItem.library_section << section_ids
-        ]
-
-        # Build query
-        query = self._join(
-            MetadataItem.select(*fields),
-            self._models(fields, account),
-            account
-        ).where(
-            *where
+            key = ('seasons', tuple(id(field) for field in fields)) + self._normalize(sections, account)
+        else:
+            key = None
+
+        cursor = self._execute_cached(key)
+
+        if cursor is None:
+            # Normalize `sections` / `account` arguments
+            section_ids, account = self._normalize(sections, account)
+
+            # Build `where()` query
+            if where is None:
+                where = []
+
+            where += [
+                MetadataItem.metadata_type == MetadataItemType.Season,
+                MetadataItem.library_section << section_ids
+            ]
+
+            # Build query (ordered by primary key, for sequential page access)
+            query = self._join(
+                MetadataItem.select(*fields),
+                self._models(fields, account),
+                account
+            ).where(
+                *where
+            ).order_by(
+                MetadataItem.id.asc()
+            )
+
+            cursor = self._execute(query, key)
+
+        # Parse rows (lazily, memory stays proportional to one row - wrap in
+        # `list()` if the result needs to be retained or iterated multiple times)
+        parsers = self._compile_parsers(fields, offset=1)
+
+        return (
+            self._parse(fields, row, offset=1, parsers=parsers)
+            for row in self._batch_iterator(cursor)
         )
 
-        # Parse rows
-        return [
-            self._parse(fields, row, offset=1)
-            for row in self._tuple_iterator(query)
-        ]
-
 
 class EpisodeLibrary(LibraryBase):
     def __call__(self, sections, fields=None, account=None, where=None):
@@ -536,19 +824,34 @@ class EpisodeLibrary(LibraryBase):
             MetadataItem.index
         ] + fields
 
-        # Build query
-        query = self.query(
-            sections,
-            fields=fields,
-            account=account,
-            where=where
-        )
+        # Re-use rendered SQL for the plain query shape (`where` conditions
+        # are caller-specific, so filtered queries aren't cached)
+        if where is None:
+            key = ('episodes', tuple(id(field) for field in fields)) + self._normalize(sections, account)
+        else:
+            key = None
 
-        # Parse rows
-        return [
-            self._parse(fields, row, offset=2)
-            for row in self._tuple_iterator(query)
-        ]
+        cursor = self._execute_cached(key)
+
+        if cursor is None:
+            # Build query
+            query = self.query(
+                sections,
+                fields=fields,
+                account=account,
+                where=where
+            )
+
+            cursor = self._execute(query, key)
+
+        # Parse rows (lazily, memory stays proportional to one row - wrap in
+        # `list()` if the result needs to be retained or iterated multiple times)
+        parsers = self._compile_parsers(fields, offset=2)
+
+        return (
+            self._parse(fields, row, offset=2, parsers=parsers)
+            for row in self._batch_iterator(cursor)
+        )
 
     def count(self, sections):
         # Build query
@@ -558,8 +861,8 @@ class EpisodeLibrary(LibraryBase):
         return query.count()
 
     def count_items(self, sections):
-        # Map `Section` list to ids
-        section_ids = [id for (id, ) in sections]
+        # Normalize `sections` argument
+        section_ids, _ = self._normalize(sections)
 
         # Build query
         query = MetadataItem.select(
@@ -573,12 +876,8 @@ class EpisodeLibrary(LibraryBase):
         return query.scalar()
 
     def query(self, sections, fields=None, account=None, where=None):
-        # Retrieve `id` from `Account`
-        if account and type(account) is Account:
-            account = account.id
-
-        # Map `Section` list to ids
-        section_ids = [id for (id, ) in sections]
+        # Normalize `sections` / `account` arguments
+        section_ids, account = self._normalize(sections, account)
 
         # Build `select()` query
         if fields is None:
@@ -593,19 +892,20 @@ class EpisodeLibrary(LibraryBase):
             MetadataItem.metadata_type == MetadataItemType.Episode
         ]
 
-        # Build query
+        # Build query (ordered by primary key, for sequential page access)
         return self._join(
             MetadataItem.select(*fields),
             self._models(fields, account),
             account
         ).where(
             *where
+        ).order_by(
+            MetadataItem.id.asc()
         )
 
     def mapped(self, sections, fields=None, account=None, parse_guid=False):
-        # Retrieve `id` from `Account`
-        if account and type(account) is Account:
-            account = account.id
+        # Normalize `account` argument
+        _, account = self._normalize((), account)
 
         # Parse `fields`
         if fields is None:
@@ -613,61 +913,77 @@ class EpisodeLibrary(LibraryBase):
 
         sh_fields, se_fields, ep_fields = fields
 
-        # Retrieve items
-        shows = self.mapped_shows(sections, sh_fields, account)
-        seasons = self.mapped_seasons(sections, se_fields, account)
+        # Retrieve items (shows + seasons are fetched in one scan)
+        shows, seasons = self.mapped_shows_seasons(sections, sh_fields, se_fields, account)
         episodes = self.mapped_episodes(sections, ep_fields, account)
 
+        # Resolve `matcher` once (`self.matcher` is a property chain)
+        matcher = self.matcher
+
+        if matcher is not None:
+            process_episode = matcher.process_episode
+        else:
+            process_episode = None
+
         # Prime `Matcher` cache
-        if self.matcher is not None and self.matcher.cache is not None and hasattr(self.matcher.cache, 'prime'):
-            context = self.matcher.cache.prime(force=True)
+        if matcher is not None and matcher.cache is not None and hasattr(matcher.cache, 'prime'):
+            context = matcher.cache.prime(force=True)
         else:
             context = PrimeContext()
 
-        # Show iterator, parse guid (if enabled)
-        guids = {}
+        # Parse show guids up-front (if enabled, shared by both iterators)
+        guid_parse = Guid.parse
 
+        if parse_guid:
+            guids = dict(
+                (sh_id, guid_parse(guid, strict=True))
+                for sh_id, (guid, _) in shows.items()
+            )
+        else:
+            guids = None
+
+        # Show iterator
         def shows_iterator():
             for sh_id, (guid, show) in shows.items():
-                # Parse `guid` (if enabled, and not already parsed)
-                if parse_guid:
-                    if id not in guids:
-                        guids[sh_id] = Guid.parse(guid, strict=True)
-
+                if guids is not None:
                     guid = guids[sh_id]
 
                 yield sh_id, guid, show
 
         # Episode iterator, parse guid (if enabled)
         def episodes_iterator():
+            # Bind lookups as locals (resolved once, instead of per episode)
+            shows_get = shows.get
+            seasons_get = seasons.get
+            log_debug = log.debug
+
             for sh_id, se_id, ep_id, ep_index, episode in episodes:
                 # Retrieve parents
-                if sh_id not in shows:
-                    log.debug('Unable to find show by id: %r', sh_id)
-                    continue
-
-                guid, show = shows[sh_id]
+                entry = shows_get(sh_id)
 
-                if se_id not in seasons:
-                    log.debug('Unable to find season by id: %r', se_id)
+                if entry is None:
+                    log_debug('Unable to find show by id: %r', sh_id)
                     continue
 
-                season = seasons[se_id]
+                guid, show = entry
 
-                # Parse `guid` (if enabled, and not already parsed)
-                if parse_guid:
-                    if id not in guids:
-                        guids[sh_id] = Guid.parse(guid, strict=True)
+                season = seasons_get(se_id)
+
+                if season is None:
+                    log_debug('Unable to find season by id: %r', se_id)
+                    continue
 
+                # Retrieve parsed `guid` (if enabled)
+                if guids is not None:
                     guid = guids[sh_id]
 
                 # Retrieve episode identifier
                 season_num, episode_nums = season['index'], [ep_index]
 
                 # Run `Matcher` on episode (if available)
-                if self.matcher is not None:
+                if process_episode is not None:
                     with context:
-                        season_num, episode_nums = self.matcher.process_episode(
+                        season_num, episode_nums = process_episode(
                             ep_id,
                             (season['index'], ep_index),
                             episode['part']['file']
@@ -724,26 +1040,208 @@ class EpisodeLibrary(LibraryBase):
             for (id, show) in seasons
         ])
 
+    # Cached show/season dictionaries, keyed on the query shape and
+    # invalidated via the change stamp (see `_shows_seasons_stamp`)
+    _shows_seasons_cache = {}
+
+    @staticmethod
+    def _shows_seasons_stamp(section_ids, account):
+        # Cheap change probe - item edits and additions bump `changed_at` or
+        # the row count, rating changes bump the settings stamp
+        items = MetadataItem.select(
+            peewee.fn.MAX(MetadataItem.changed_at),
+            peewee.fn.COUNT(MetadataItem.id)
+        ).where(
+            MetadataItem.library_section << section_ids,
+            MetadataItem.metadata_type << [MetadataItemType.Show, MetadataItemType.Season]
+        ).scalar(as_tuple=True)
+
+        settings = MetadataItemSettings.select(
+            peewee.fn.MAX(MetadataItemSettings.changed_at),
+            peewee.fn.COUNT(MetadataItemSettings.id)
+        ).where(
+            MetadataItemSettings.account == account
+        ).scalar(as_tuple=True)
+
+        return items, settings
+
+    def mapped_shows_seasons(self, sections, sh_fields=None, se_fields=None, account=None):
+        # Parse `fields`
+        if sh_fields is None:
+            sh_fields = []
+
+        if se_fields is None:
+            se_fields = []
+
+        # Re-use rendered SQL when the query shape is unchanged
+        key = (
+            'episodes.shows_seasons',
+            tuple(id(field) for field in sh_fields),
+            tuple(id(field) for field in se_fields)
+        ) + self._normalize(sections, account)
+
+        # Re-use the parsed dictionaries when nothing changed since the last
+        # sync run (the stamp probe is two aggregate queries, instead of the
+        # full show/season scan)
+        stamp = self._shows_seasons_stamp(*self._normalize(sections, account))
+
+        cached = self._shows_seasons_cache.get(key)
+
+        if cached is not None and cached[0] == stamp:
+            return cached[1], cached[2]
+
+        cursor = self._execute_cached(key)
+
+        if cursor is None:
+            # Normalize `sections` argument
+            section_ids, _ = self._normalize(sections)
+
+            # Build subquery (one tag per item - SQLite resolves the bare `tag`
+            # column from the `MIN(id)` row, matching the previous first-wins order)
+            subq = (Taggings
+                    .select(
+                        Tags.tag,
+                        peewee.fn.MIN(Tags.id),
+                        Taggings.metadata_item
+                    )
+                    .join(Tags, on=(Tags.id == Taggings.tag).alias('taggings'))
+                    .where(Tags.tag_type == 314)
+                    .group_by(Taggings.metadata_item)
+                    .switch(Taggings)
+                    .alias('subq')
+            )
+
+            fields = [
+                MetadataItem.id,
+                MetadataItem.metadata_type,
+                MetadataItem.guid,
+                MetadataItem.index,
+                subq.c.tag,
+
+                MetadataItemSettings.rating
+            ] + sh_fields + se_fields
+
+            # Build query
+            query = (MetadataItem.select(*fields)
+                            .join(subq, JOIN_LEFT_OUTER, on=(subq.c.metadata_item_id == MetadataItem.id).alias('tags'))
+                            .switch(MetadataItem)
+            )
+
+            # Join settings
+            query = self._join_settings(query, account, MetadataItem)
+
+            # Join extra models
+            models = self._models(fields, account)
+
+            query = self._join(query, models, account, [
+                MetadataItemSettings,
+                Taggings,
+                Tags
+            ])
+
+            # Apply `WHERE` filter (ordered by primary key, for sequential page access)
+            query = query.where(
+                MetadataItem.library_section << section_ids,
+                MetadataItem.metadata_type << [MetadataItemType.Show, MetadataItemType.Season]
+            ).order_by(
+                MetadataItem.id.asc()
+            )
+
+            cursor = self._execute(query, key)
+
+        # Compile parsers ("rating" is parsed by hand, per metadata type)
+        sh_parsers = self._compile_parsers(sh_fields)
+        se_parsers = self._compile_parsers(se_fields)
+
+        sh_offset = 6
+        se_offset = sh_offset + len(sh_fields)
+
+        # Iterate over items, building show + season dictionaries in one pass
+        shows = {}
+        seasons = {}
+
+        for row in self._batch_iterator(cursor):
+            # Note: assigning to `id` here would shadow the builtin used by
+            # the cache-key generator expressions above
+            item_id, metadata_type, guid, index, tag, rating = row[:sh_offset]
+
+            if metadata_type == MetadataItemType.Show:
+                if item_id in shows:
+                    continue
+
+                show = self._parse(sh_fields, row, offset=sh_offset, parsers=sh_parsers)[-1]
+                show.setdefault('settings', {}).setdefault('rating', rating)
+
+                if tag:
+                    shows[item_id] = (tag, show)
+                else:
+                    shows[item_id] = (guid, show)
+            else:
+                if item_id in seasons:
+                    continue
+
+                season = self._parse(se_fields, row, offset=se_offset, parsers=se_parsers)[-1]
+                season['index'] = index
+                season.setdefault('settings', {}).setdefault('rating', rating)
+
+                seasons[item_id] = season
+
+        # Store result (bounded, keys contain caller-provided field sets)
+        if len(self._shows_seasons_cache) >= 16:
+            self._shows_seasons_cache.clear()
+
+        self._shows_seasons_cache[key] = (stamp, shows, seasons)
+
+        return shows, seasons
+
     def mapped_episodes(self, sections, fields=None, account=None, where=None):
-        # Map `Section` list to ids
-        section_ids = [id for (id, ) in sections]
+        # Normalize `sections` argument
+        section_ids, _ = self._normalize(sections)
 
         # Build `select()` query
-        fields = [
-            MetadataItem.id,
-            Season.id,
+        if fields is None:
+            fields = []
 
-            Episode.id,
-            Episode.index,
+        # Prefetch account settings into a dictionary when no settings columns
+        # were requested, replacing the per-row settings join with a hash
+        # lookup on the episode guid
+        prefetch_settings = not any(
+            field.model_class is MetadataItemSettings
+            for field in fields
+        )
 
-            MediaPart.duration,
-            MediaPart.file,
+        if prefetch_settings:
+            fields = [
+                MetadataItem.id,
+                Season.id,
 
-            MetadataItemSettings.rating,
-            MetadataItemSettings.view_count,
-            MetadataItemSettings.view_offset,
-            MetadataItemSettings.last_viewed_at
-        ] + fields
+                Episode.id,
+                Episode.index,
+                Episode.guid,
+
+                MediaPart.duration,
+                MediaPart.file
+            ] + fields
+
+            offset = 5
+        else:
+            fields = [
+                MetadataItem.id,
+                Season.id,
+
+                Episode.id,
+                Episode.index,
+
+                MediaPart.duration,
+                MediaPart.file,
+
+                MetadataItemSettings.rating,
+                MetadataItemSettings.view_count,
+                MetadataItemSettings.view_offset,
+                MetadataItemSettings.last_viewed_at
+            ] + fields
+
+            offset = 4
 
         # Build `where()` query
         if where is None:
@@ -763,8 +1261,9 @@ class EpisodeLibrary(LibraryBase):
                              .switch(Episode)
         )
 
-        # Join settings
-        query = self._join_settings(query, account, Episode)
+        # Join settings (only needed when settings columns are selected)
+        if not prefetch_settings:
+            query = self._join_settings(query, account, Episode)
 
         # Join extra models
         models = self._models(fields, account)
@@ -780,12 +1279,113 @@ class EpisodeLibrary(LibraryBase):
             *where
         )
 
+        parsers = self._compile_parsers(fields, offset=offset)
+
         def iterator():
-            for row in self._tuple_iterator(query):
-                yield self._parse(fields, row, offset=4)
+            if prefetch_settings:
+                settings = self._prefetch_settings(account)
+            else:
+                settings = None
+
+            # Retrieve episodes in pages (keyset pagination on the episode id),
+            # bounding the working set for large libraries
+            last_id = None
+
+            while True:
+                # Resolve the page's upper episode id with an indexed probe
+                # (episodes with multiple media parts span several rows, so
+                # pages are bounded by episode id - not a row limit - to keep
+                # every row of an episode in the same page)
+                boundary_where = [
+                    MetadataItem.metadata_type == MetadataItemType.Episode,
+                    MetadataItem.library_section << section_ids
+                ]
+
+                if last_id is not None:
+                    boundary_where.append(MetadataItem.id > last_id)
+
+                boundary = (MetadataItem
+                            .select(MetadataItem.id)
+                            .where(*boundary_where)
+                            .order_by(MetadataItem.id.asc())
+                            .limit(1)
+                            .offset(EPISODE_BATCH - 1)
+                            .scalar())
+
+                page = query.order_by(Episode.id.asc())
+
+                if last_id is not None:
+                    page = page.where(Episode.id > last_id)
+
+                if boundary is not None:
+                    page = page.where(Episode.id <= boundary)
+
+                for row in self._batch_iterator(page._execute()):
+                    parsed = self._parse(fields, row, offset=offset, parsers=parsers)
+
+                    if settings is None:
+                        yield parsed
+                        continue
+
+                    sh_id, se_id, ep_id, ep_index, ep_guid = parsed[:5]
+                    episode = parsed[-1]
+
+                    # Attach prefetched settings
+                    stored = settings.get(ep_guid)
+
+                    if stored is not None:
+                        rating, view_count, view_offset, last_viewed_at = stored
+                    else:
+                        rating = view_count = view_offset = last_viewed_at = None
+
+                    episode['settings'] = {
+                        'rating': rating,
+                        'view_count': view_count,
+                        'view_offset': view_offset,
+                        'last_viewed_at': last_viewed_at
+                    }
+
+                    yield sh_id, se_id, ep_id, ep_index, episode
+
+                # Stop after the final page (no episode ids beyond the
+                # boundary - row counts are unreliable, rows can be dropped
+                # by joins or decode errors)
+                if boundary is None:
+                    break
+
+                last_id = boundary
 
         return iterator()
 
+    def _prefetch_settings(self, account):
+        # Re-use rendered SQL when the query shape is unchanged
+        key = ('episodes.settings', account)
+
+        cursor = self._execute_cached(key)
+
+        if cursor is None:
+            query = MetadataItemSettings.select(
+                MetadataItemSettings.guid,
+
+                MetadataItemSettings.rating,
+                MetadataItemSettings.view_count,
+                MetadataItemSettings.view_offset,
+                MetadataItemSettings.last_viewed_at
+            ).where(
+                MetadataItemSettings.account == account
+            )
+
+            cursor = self._execute(query, key)
+
+        parse_datetime = self._build_datetime_parser()
+
+        result = {}
+
+        for guid, rating, view_count, view_offset, last_viewed_at in self._batch_iterator(cursor):
+            result[guid] = (rating, view_count, view_offset, parse_datetime(last_viewed_at))
+
+        return result
+
 
 class Library(object):
     matcher = Matcher
@@ -1,5 +1,9 @@
 from plex.lib.six.moves.urllib_parse import urlparse as std_urlparse
 
+from collections import namedtuple
+
+Uri = namedtuple('Uri', ['netloc', 'path', 'query'])
+
 
 def try_convert(value, value_type, default=None):
     try:
@@ -14,9 +18,32 @@ def urlparse(url):
     scheme = None
     scheme_pos = url.find('://')
 
-    if scheme_pos != -1:
-        scheme = url[:scheme_pos]
-        url = url[scheme_pos + 1:]
+    if scheme_pos == -1 or '#' in url:
+        # Unusual shape, defer to the generic parser
+        if scheme_pos != -1:
+            scheme = url[:scheme_pos]
+            url = url[scheme_pos + 1:]
+
+        return scheme, std_urlparse(url)
+
+    # Fast path for "<agent>://<id>[/<path>][?<query>]" guids, avoiding the
+    # generic url parser on hot paths (e.g. `Guid.parse`)
+    scheme = url[:scheme_pos]
+    rest = url[scheme_pos + 3:]
+
+    query = ''
+    query_pos = rest.find('?')
+
+    if query_pos != -1:
+        query = rest[query_pos + 1:]
+        rest = rest[:query_pos]
+
+    path = ''
+    path_pos = rest.find('/')
+
+    if path_pos != -1:
+        path = rest[path_pos:]
+        rest = rest[:path_pos]
 
-    return scheme, std_urlparse(url)
+    return scheme, Uri(rest, path, query)
 
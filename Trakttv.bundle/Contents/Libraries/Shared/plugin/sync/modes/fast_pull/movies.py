@@ -36,27 +36,25 @@ class Movies(Base):
         # Retrieve movie sections
         self.p_sections, self.p_sections_map = self.sections('movie')
 
-        # Determine number of movies that will be processed
-        self.p_count = self.plex.library.movies.count(
-            self.p_sections,
-            account=self.current.account.plex.key
-        )
-
-        # Increment progress steps total
-        self.current.progress.group(Movies).add(self.p_count)
-
     @elapsed.clock
     def start(self):
-        # Fetch movies with account settings
+        # Fetch movies with account settings (and the item count, in one scan)
         self.p_movies = self.plex.library.movies.mapped(
             self.p_sections, [
                 MetadataItem.library_section,
                 MetadataItem.added_at
             ],
             account=self.current.account.plex.key,
-            parse_guid=True
+            parse_guid=True,
+            with_count=True
         )
 
+        # Determine number of movies that will be processed
+        self.p_count = self.p_movies.count
+
+        # Increment progress steps total
+        self.current.progress.group(Movies).add(self.p_count)
+
         # Reset state
         self.p_unsupported = {}
 
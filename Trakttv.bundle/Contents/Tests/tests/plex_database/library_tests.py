@@ -0,0 +1,190 @@
+from peewee import SqliteDatabase
+from plex_database.library import Library
+from plex_database.models import (
+    Account, Directory, Episode, LibrarySection, MediaItem, MediaPart,
+    MetadataItem, MetadataItemSettings, MetadataItemType, Tags, Taggings
+)
+from plex_database.models.section_location import SectionLocation
+
+
+MODELS = [
+    Account,
+    LibrarySection,
+    Directory,
+    SectionLocation,
+
+    MetadataItem,
+    MetadataItemSettings,
+
+    MediaItem,
+    MediaPart,
+
+    Tags,
+    Taggings
+]
+
+SECTIONS = [(2,)]
+
+
+def setup_module(module):
+    # Bind models to an in-memory database
+    database = SqliteDatabase(':memory:')
+
+    for model in MODELS:
+        model._meta.database = database
+
+    database.create_tables(MODELS)
+
+    seed()
+
+
+def seed():
+    Account.create(id=1, name='test')
+
+    section = LibrarySection.create(
+        id=2, section_type=2,
+        agent='com.plexapp.agents.thetvdb',
+        name='Shows'
+    )
+
+    ep_id = 3000
+
+    for s in xrange(1, 3):
+        show = MetadataItem.create(
+            id=1000 + s, library_section=section,
+            metadata_type=MetadataItemType.Show,
+            guid='com.plexapp.agents.thetvdb://700%d?lang=en' % s,
+            title='Show %d' % s, year=2010 + s
+        )
+
+        for se in xrange(1, 3):
+            season = MetadataItem.create(
+                id=2000 + s * 10 + se, library_section=section, parent=show,
+                metadata_type=MetadataItemType.Season, index=se,
+                guid='com.plexapp.agents.thetvdb://700%d/%d?lang=en' % (s, se)
+            )
+
+            for e in xrange(1, 4):
+                ep_id += 1
+
+                episode = MetadataItem.create(
+                    id=ep_id, library_section=section, parent=season,
+                    metadata_type=MetadataItemType.Episode, index=e,
+                    guid='com.plexapp.agents.thetvdb://700%d/%d/%d?lang=en' % (s, se, e),
+                    title='Episode %d' % e
+                )
+
+                media = MediaItem.create(id=ep_id, library_section=section, metadata_item=episode)
+
+                MediaPart.create(
+                    id=ep_id, media_item=media,
+                    file='/media/s%d_se%d_e%d.mkv' % (s, se, e),
+                    duration=1200000 + e
+                )
+
+    MetadataItemSettings.create(
+        account=1, guid='com.plexapp.agents.thetvdb://7001?lang=en',
+        rating=9.0
+    )
+
+    MetadataItemSettings.create(
+        account=1, guid='com.plexapp.agents.thetvdb://7001/1/1?lang=en',
+        rating=7.5, view_count=1, view_offset=60000
+    )
+
+
+def test_mapped_shows_seasons():
+    shows, seasons = Library.episodes.mapped_shows_seasons(
+        SECTIONS,
+        sh_fields=[MetadataItem.year],
+        se_fields=[MetadataItem.index],
+        account=1
+    )
+
+    assert len(shows) == 2
+    assert len(seasons) == 4
+
+    guid, show = shows[1001]
+
+    assert guid == 'com.plexapp.agents.thetvdb://7001?lang=en'
+    assert show['year'] == 2011
+    assert show['settings']['rating'] == 9.0
+
+    assert seasons[2011]['index'] == 1
+
+
+def test_shows_seasons_cache():
+    sh_fields = [MetadataItem.title]
+    se_fields = []
+
+    shows, seasons = Library.episodes.mapped_shows_seasons(
+        SECTIONS,
+        sh_fields=sh_fields,
+        se_fields=se_fields,
+        account=1
+    )
+
+    assert shows[1002][1]['title'] == 'Show 2'
+
+    # Unchanged stamp - the parsed dictionaries are re-used
+    c_shows, c_seasons = Library.episodes.mapped_shows_seasons(
+        SECTIONS,
+        sh_fields=sh_fields,
+        se_fields=se_fields,
+        account=1
+    )
+
+    assert c_shows is shows
+    assert c_seasons is seasons
+
+    # Item edit bumps `changed_at` - the cache entry is invalidated
+    MetadataItem.update(
+        title='Show 2 (renamed)',
+        changed_at=MetadataItem.changed_at + 1
+    ).where(
+        MetadataItem.id == 1002
+    ).execute()
+
+    u_shows, u_seasons = Library.episodes.mapped_shows_seasons(
+        SECTIONS,
+        sh_fields=sh_fields,
+        se_fields=se_fields,
+        account=1
+    )
+
+    assert u_shows is not shows
+    assert u_shows[1002][1]['title'] == 'Show 2 (renamed)'
+
+
+def test_mapped_episodes():
+    # Field shape used by the show sync modes
+    p_shows, p_seasons, p_episodes = Library.episodes.mapped(
+        SECTIONS, (
+            [MetadataItem.year],
+            [],
+            [Episode.title]
+        ),
+        account=1,
+        parse_guid=True
+    )
+
+    shows = dict(
+        (sh_id, (guid, show))
+        for sh_id, guid, show in p_shows
+    )
+
+    episodes = list(p_episodes)
+
+    assert len(shows) == 2
+    assert len(p_seasons) == 4
+    assert len(episodes) == 12
+
+    assert shows[1001][1]['year'] == 2011
+
+    ids, guid, (season_num, episode_num), show, season, episode = episodes[0]
+
+    assert ids['show'] in shows
+    assert guid.service == 'tvdb'
+    assert season_num == season['index']
+    assert episode['title'].startswith('Episode')
+    assert episode['settings'] is not None